@@ -36,7 +36,8 @@ def run_centralized(optimizer: tf.keras.optimizers.Optimizer,
                     lr_decay: Optional[float] = None,
                     hparams_dict: Optional[Mapping[str, Any]] = None,
                     crop_size: Optional[int] = 24,
-                    max_batches: Optional[int] = None):
+                    max_batches: Optional[int] = None,
+                    use_numba_pipeline: bool = False):
   """Trains a ResNet-18 on CIFAR-100 using a given optimizer.
 
   Args:
@@ -58,18 +59,33 @@ def run_centralized(optimizer: tf.keras.optimizers.Optimizer,
     max_batches: If set to a positive integer, datasets are capped to at most
       that many batches. If set to None or a nonpositive integer, the full
       datasets are used.
+    use_numba_pipeline: Whether to build the training dataset with the numba
+      pipeline of `cifar100_dataset.get_centralized_datasets`.
   """
   crop_shape = (crop_size, crop_size, NUM_CHANNELS)
 
   cifar_train, cifar_test = cifar100_dataset.get_centralized_datasets(
-      train_batch_size=batch_size, crop_shape=crop_shape)
+      train_batch_size=batch_size,
+      crop_shape=crop_shape,
+      use_numba_pipeline=use_numba_pipeline)
 
   if max_batches and max_batches >= 1:
     cifar_train = cifar_train.take(max_batches)
     cifar_test = cifar_test.take(max_batches)
 
-  model = resnet_models.create_resnet18(
-      input_shape=crop_shape, num_classes=NUM_CLASSES)
+  # Prefetching training batches into GPU memory overlaps host-to-device copies
+  # with training. It must be the last transformation of the dataset.
+  if tf.config.list_physical_devices('GPU'):
+    cifar_train = cifar_train.apply(
+        tf.data.experimental.prefetch_to_device('/GPU:0'))
+
+  # The datasets contain uint8 images, which are normalized by the model.
+  model = tf.keras.Sequential([
+      tf.keras.layers.InputLayer(input_shape=crop_shape, dtype=tf.uint8),
+      tf.keras.layers.Lambda(cifar100_dataset.normalize_images),
+      resnet_models.create_resnet18(
+          input_shape=crop_shape, num_classes=NUM_CLASSES),
+  ])
   model.compile(
       loss=tf.keras.losses.SparseCategoricalCrossentropy(),
       optimizer=optimizer,
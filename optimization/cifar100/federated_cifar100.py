@@ -13,7 +13,6 @@
 # limitations under the License.
 """Federated CIFAR-100 classification library using TFF."""
 
-import functools
 from typing import Callable, Optional
 
 from absl import logging
@@ -96,10 +95,14 @@ def run_federated(
   input_spec = cifar_train.create_tf_dataset_for_client(
       cifar_train.client_ids[0]).element_spec
 
-  model_builder = functools.partial(
-      resnet_models.create_resnet18,
-      input_shape=crop_shape,
-      num_classes=NUM_CLASSES)
+  def model_builder() -> tf.keras.Model:
+    # The datasets contain uint8 images, which are normalized by the model.
+    return tf.keras.Sequential([
+        tf.keras.layers.InputLayer(input_shape=crop_shape, dtype=tf.uint8),
+        tf.keras.layers.Lambda(cifar100_dataset.normalize_images),
+        resnet_models.create_resnet18(
+            input_shape=crop_shape, num_classes=NUM_CLASSES),
+    ])
 
   loss_builder = tf.keras.losses.SparseCategoricalCrossentropy
   metrics_builder = lambda: [tf.keras.metrics.SparseCategoricalAccuracy()]
@@ -64,6 +64,10 @@ with utils_impl.record_new_flags() as hparam_flags:
   # CIFAR-100 flags
   flags.DEFINE_integer('cifar100_crop_size', 24, 'The height and width of '
                        'images after preprocessing.')
+  flags.DEFINE_boolean(
+      'cifar100_use_numba_pipeline', False,
+      'Whether to build the training dataset with the numba pipeline, which '
+      'is faster for CPU-only runs and fully shuffles each epoch.')
 
   # EMNIST character recognition flags
   flags.DEFINE_enum('emnist_cr_model', 'cnn', ['cnn', '2nn'],
@@ -126,7 +130,9 @@ def main(argv):
 
   if FLAGS.task == 'cifar100':
     centralized_cifar100.run_centralized(
-        **common_args, crop_size=FLAGS.cifar100_crop_size)
+        **common_args,
+        crop_size=FLAGS.cifar100_crop_size,
+        use_numba_pipeline=FLAGS.cifar100_use_numba_pipeline)
 
   elif FLAGS.task == 'emnist_cr':
     centralized_emnist.run_centralized(
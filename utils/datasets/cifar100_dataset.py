@@ -14,22 +14,165 @@
 """Library for loading and preprocessing CIFAR-100 training and testing data."""
 
 import collections
-from typing import Tuple
+import functools
+import os
+from typing import Optional, Tuple
 
+import numpy as np
 import tensorflow as tf
 import tensorflow_federated as tff
 
 CIFAR_SHAPE = (32, 32, 3)
 TOTAL_FEATURE_SIZE = 32 * 32 * 3
 NUM_EXAMPLES_PER_CLIENT = 500
+# Per-channel statistics of the CIFAR-100 training images, on a [0, 255] scale.
+_CIFAR_MEAN = (0.5071 * 255., 0.4865 * 255., 0.4409 * 255.)
+_CIFAR_INV_STD = (1. / (0.2673 * 255.), 1. / (0.2564 * 255.),
+                  1. / (0.2762 * 255.))
+# Normalization written as a single affine map, `image * scale - bias`.
+_CIFAR_SCALE = _CIFAR_INV_STD
+_CIFAR_BIAS = tuple(m * s for m, s in zip(_CIFAR_MEAN, _CIFAR_INV_STD))
+
+
+def _tuned_options(deterministic: bool = True) -> tf.data.Options:
+  """Returns `tf.data.Options` enabling the static input pipeline rewrites."""
+  options = tf.data.Options()
+  options.experimental_deterministic = deterministic
+  options.experimental_optimization.map_fusion = True
+  options.experimental_optimization.map_parallelization = True
+  options.experimental_optimization.map_and_batch_fusion = True
+  options.experimental_optimization.parallel_batch = True
+  options.experimental_optimization.noop_elimination = True
+  options.experimental_optimization.autotune_buffers = True
+  return options
+
+
+def normalize_images(images):
+  """Casts CIFAR-100 images to `tf.float32` and normalizes their channels.
+
+  The datasets produced by this module contain `tf.uint8` images, so that they
+  are transferred to the accelerator at a quarter of the size of `tf.float32`
+  images. Models consuming them should apply this function first, for example
+  via `tf.keras.layers.Lambda(normalize_images)`.
+
+  Args:
+    images: A tensor of images whose last dimension indexes the RGB channels.
+
+  Returns:
+    A `tf.float32` tensor of the same shape, where each channel is normalized
+    using the mean and standard deviation of that channel over the CIFAR-100
+    training images.
+  """
+  return (tf.cast(images, tf.float32) * tf.constant(_CIFAR_SCALE) -
+          tf.constant(_CIFAR_BIAS))
+
+
+def _batch_crop(images, crop_shape, seed):
+  """Randomly crops each image in a batch to `crop_shape`.
+
+  Args:
+    images: A tensor of shape (batch_size, height, width, channels).
+    crop_shape: A tuple (crop_height, crop_width, num_channels).
+    seed: A tensor of shape (2,) used to seed the stateless random crops.
+
+  Returns:
+    A tensor of shape (batch_size, crop_height, crop_width, channels).
+  """
+  seed_y, seed_x = tf.unstack(tf.random.experimental.stateless_split(seed, 2))
+  batch_size = tf.shape(images)[0]
+  max_offset_y = tf.shape(images)[1] - crop_shape[0] + 1
+  max_offset_x = tf.shape(images)[2] - crop_shape[1] + 1
+  offset_y = tf.random.stateless_uniform([batch_size, 1],
+                                         seed=seed_y,
+                                         minval=0,
+                                         maxval=max_offset_y,
+                                         dtype=tf.int32)
+  offset_x = tf.random.stateless_uniform([batch_size, 1],
+                                         seed=seed_x,
+                                         minval=0,
+                                         maxval=max_offset_x,
+                                         dtype=tf.int32)
+  rows = offset_y + tf.range(crop_shape[0])
+  columns = offset_x + tf.range(crop_shape[1])
+  images = tf.gather(images, rows, axis=1, batch_dims=1)
+  return tf.gather(images, columns, axis=2, batch_dims=1)
+
+
+def _batch_flip(images, seed):
+  """Flips each image in a batch left to right with probability 1/2.
+
+  Args:
+    images: A tensor of shape (batch_size, height, width, channels).
+    seed: A tensor of shape (2,) used to seed the stateless random flips.
+
+  Returns:
+    A tensor of the same shape as `images`.
+  """
+  mask = tf.random.stateless_uniform([tf.shape(images)[0]], seed=seed) < 0.5
+  return tf.where(mask[:, None, None, None], tf.reverse(images, axis=[2]),
+                  images)
+
+
+def _build_image_maps(crop_shape, distort=False):
+  """Builds the per-example and per-batch stages of `build_image_map`.
+
+  Both stages act on `(image, label)` pairs. When `distort` is False, the
+  example stage crops the image. Otherwise, the batch stage randomly crops and
+  flips the images of a batch of examples. It takes a third argument, a seed of
+  shape (2,) that determines the crops and flips, so that it only uses
+  stateless random ops. Both stages leave the image as a `tf.uint8` tensor.
+
+  Args:
+    crop_shape: A tuple (crop_height, crop_width, num_channels) specifying the
+      desired crop shape for pre-processing.
+    distort: A boolean indicating whether to distort the image via random crops
+      and flips.
+
+  Returns:
+    A tuple `(example_map, batch_map)`, exactly one of which is `None`. The
+    other is a `tf.function` with a fixed input signature, so that it is traced
+    only once. The batch stage is also compiled with XLA.
+  """
+  if distort:
+
+    @tf.function(
+        input_signature=[
+            tf.TensorSpec((None,) + CIFAR_SHAPE, tf.uint8),
+            tf.TensorSpec((None,), tf.int64),
+            tf.TensorSpec((2,), tf.int64)
+        ],
+        experimental_compile=True)
+    def batch_map(images, labels, seed):
+      crop_seed, flip_seed = tf.unstack(
+          tf.random.experimental.stateless_split(seed, 2))
+      images = _batch_crop(images, crop_shape, crop_seed)
+      return (_batch_flip(images, flip_seed), labels)
+
+    return None, batch_map
+
+  @tf.function(
+      input_signature=[
+          tf.TensorSpec(CIFAR_SHAPE, tf.uint8),
+          tf.TensorSpec((), tf.int64)
+      ])
+  def example_map(image, label):
+    # Since the crop never exceeds the image, a center crop is a slice whose
+    # offsets are known when the map is traced.
+    offset_y = (image.shape[0] - crop_shape[0]) // 2
+    offset_x = (image.shape[1] - crop_shape[1]) // 2
+    image = image[offset_y:offset_y + crop_shape[0],
+                  offset_x:offset_x + crop_shape[1], :]
+    return (image, label)
+
+  return example_map, None
 
 
 def build_image_map(crop_shape, distort=False):
-  """Builds a function that crops and normalizes CIFAR-100 elements.
+  """Builds a function that crops CIFAR-100 elements.
 
-  The image is first converted to a `tf.float32`, then cropped (according to
-  the `distort` argument). Finally, its values are normalized via
-  `tf.image.per_image_standardization`.
+  The image is cropped (according to the `distort` argument) and keeps its
+  `tf.uint8` dtype. Normalization is deferred to the model, see
+  `normalize_images`.
 
   Args:
     crop_shape: A tuple (crop_height, crop_width, num_channels) specifying the
@@ -37,34 +180,64 @@ def build_image_map(crop_shape, distort=False):
       exceeding (32, 32, 3), element-wise. The element in the last index should
       be set to 3 to maintain the RGB image structure of the elements.
     distort: A boolean indicating whether to distort the image via random crops
-      and flips. If set to False, the image is resized to the `crop_shape` via
-      `tf.image.resize_with_crop_or_pad`.
+      and flips. If set to False, the image is center cropped to the
+      `crop_shape`.
 
   Returns:
-    A callable accepting a tensor of shape (32, 32, 3), and performing the
-    crops and normalization discussed above.
+    A callable accepting an image tensor of shape (32, 32, 3) and its label,
+    and performing the crops discussed above. If `distort` is True, the
+    callable also takes a `tf.int64` seed of shape (2,), which determines the
+    random crop and flip via stateless random ops.
   """
+  example_map, batch_map = _build_image_maps(crop_shape, distort)
+  if batch_map is None:
+    return example_map
 
-  if distort:
+  def image_map(image, label, seed):
+    images, _ = batch_map(
+        tf.expand_dims(image, 0), tf.expand_dims(tf.cast(label, tf.int64), 0),
+        seed)
+    return (images[0], label)
 
-    def crop_fn(image):
-      image = tf.image.random_crop(image, size=crop_shape)
-      image = tf.image.random_flip_left_right(image)
-      return image
+  return image_map
 
-  else:
 
-    def crop_fn(image):
-      return tf.image.resize_with_crop_or_pad(
-          image, target_height=crop_shape[1], target_width=crop_shape[2])
+def _validate_crop_shape(crop_shape) -> Tuple[int, int, int]:
+  """Validates `crop_shape` and returns it as a tuple."""
+  if not isinstance(crop_shape, collections.abc.Iterable):
+    raise TypeError('Argument crop_shape must be an iterable.')
+  crop_shape = tuple(crop_shape)
+  if len(crop_shape) != 3:
+    raise ValueError('The crop_shape must have length 3, corresponding to a '
+                     'tensor of shape [height, width, channels].')
+  if any(size > max_size for size, max_size in zip(crop_shape, CIFAR_SHAPE)):
+    raise ValueError(
+        'The crop_shape cannot exceed {} element-wise; you passed {}.'.format(
+            CIFAR_SHAPE, crop_shape))
+  if crop_shape[2] != CIFAR_SHAPE[2]:
+    raise ValueError(
+        'The crop_shape must keep all {} channels; you passed {}.'.format(
+            CIFAR_SHAPE[2], crop_shape))
+  return crop_shape
 
-  def image_map(example):
-    image = tf.cast(example['image'], tf.float32)
-    image = crop_fn(image)
-    image = tf.image.per_image_standardization(image)
-    return (image, example['label'])
 
-  return image_map
+def _validate_preproc_args(num_epochs, batch_size,
+                           crop_shape) -> Tuple[int, int, int]:
+  """Validates the arguments of `create_preprocess_fn`.
+
+  Args:
+    num_epochs: The `num_epochs` argument of `create_preprocess_fn`.
+    batch_size: The `batch_size` argument of `create_preprocess_fn`.
+    crop_shape: The `crop_shape` argument of `create_preprocess_fn`.
+
+  Returns:
+    The `crop_shape`, converted to a (hashable) tuple.
+  """
+  if num_epochs < 1:
+    raise ValueError('num_epochs must be a positive integer.')
+  if batch_size < 1:
+    raise ValueError('batch_size must be a positive integer.')
+  return _validate_crop_shape(crop_shape)
 
 
 def create_preprocess_fn(
@@ -73,7 +246,10 @@ def create_preprocess_fn(
     shuffle_buffer_size: int,
     crop_shape: Tuple[int, int, int] = CIFAR_SHAPE,
     distort_image=False,
-    num_parallel_calls: int = tf.data.experimental.AUTOTUNE) -> tff.Computation:
+    num_parallel_calls: int = tf.data.experimental.AUTOTUNE,
+    deterministic: bool = True,
+    snapshot_path: Optional[str] = None,
+    serializable: bool = False) -> tff.Computation:
   """Creates a preprocessing function for CIFAR-100 client datasets.
 
   Args:
@@ -90,30 +266,131 @@ def create_preprocess_fn(
       includes image distortion, including random crops and flips.
     num_parallel_calls: An integer representing the number of parallel calls
       used when performing `tf.data.Dataset.map`.
+    deterministic: A boolean indicating whether the elements of the dataset
+      must be produced in a deterministic order. If set to False, parallel
+      maps may produce elements out of order, rather than waiting for slower
+      elements to finish.
+    snapshot_path: An optional directory in which to persist the output of the
+      deterministic preprocessing, via `tf.data.experimental.snapshot`, so
+      that later runs read it from disk instead of recomputing it. The
+      snapshot is stateful, so it cannot be combined with `serializable`.
+    serializable: A boolean indicating whether the preprocessed datasets are
+      intended to be serialized and shipped across RPC channels. If `True`,
+      stateful transformations (caching and snapshots) are disallowed.
 
   Returns:
     A `tff.Computation` performing the preprocessing described above.
   """
-  if num_epochs < 1:
-    raise ValueError('num_epochs must be a positive integer.')
+  crop_shape = _validate_preproc_args(num_epochs, batch_size, crop_shape)
+  if serializable and snapshot_path is not None:
+    raise ValueError('snapshot_path cannot be set for serializable datasets.')
   if shuffle_buffer_size <= 1:
     shuffle_buffer_size = 1
+  return _create_preprocess_fn(num_epochs, batch_size, shuffle_buffer_size,
+                               crop_shape, bool(distort_image),
+                               num_parallel_calls, bool(deterministic),
+                               snapshot_path, bool(serializable))
+
 
-  feature_dtypes = collections.OrderedDict(
-      coarse_label=tff.TensorType(tf.int64),
-      image=tff.TensorType(tf.uint8, shape=(32, 32, 3)),
-      label=tff.TensorType(tf.int64))
+# Tracing a `tff.Computation` is slow, so computations are shared across calls
+# with the same (validated and hashable) arguments.
+@functools.lru_cache(maxsize=32)
+def _create_preprocess_fn(num_epochs, batch_size, shuffle_buffer_size,
+                          crop_shape, distort_image, num_parallel_calls,
+                          deterministic, snapshot_path, serializable):
+  """Creates the computation returned by `create_preprocess_fn`."""
+  feature_dtypes = (tff.TensorType(tf.uint8, shape=(32, 32, 3)),
+                    tff.TensorType(tf.int64))
 
-  image_map_fn = build_image_map(crop_shape, distort_image)
+  example_map, batch_map = _build_image_maps(crop_shape, distort_image)
 
   @tff.tf_computation(tff.SequenceType(feature_dtypes))
   def preprocess_fn(dataset):
-    return (dataset.shuffle(shuffle_buffer_size).repeat(num_epochs).batch(
-        batch_size).map(image_map_fn, num_parallel_calls=num_parallel_calls))
+    if example_map is not None:
+      dataset = dataset.map(example_map, num_parallel_calls=num_parallel_calls)
+    if snapshot_path is not None:
+      dataset = dataset.apply(
+          tf.data.experimental.snapshot(snapshot_path, compression='AUTO'))
+    elif example_map is not None and not serializable:
+      # The example stage is deterministic, so it is cached to run once per
+      # example, rather than once per example per epoch.
+      dataset = dataset.cache()
+    # The shuffle buffer holds `tf.uint8` images. Its memory grows with the
+    # size of its elements, so any transformation that widens the image dtype
+    # (such as a cast to `tf.float32`) must stay after the shuffle.
+    if shuffle_buffer_size > 1:
+      dataset = dataset.shuffle(shuffle_buffer_size)
+    dataset = dataset.repeat(num_epochs).batch(batch_size)
+    if batch_map is not None:
+      # Distorting whole batches draws the random crops and flips for a batch
+      # at once, rather than running separate kernels for each example. Each
+      # batch is paired with its own seed, so that the distortions only use
+      # stateless random ops.
+      seeds = tf.data.experimental.RandomDataset().batch(2, drop_remainder=True)
+      dataset = tf.data.Dataset.zip((dataset, seeds)).map(
+          lambda batch, seed: batch_map(*batch, seed),
+          num_parallel_calls=num_parallel_calls)
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE).with_options(
+        _tuned_options(deterministic))
 
   return preprocess_fn
 
 
+def _to_image_label_pair(example):
+  return (example['image'], example['label'])
+
+
+def _dataset_to_arrays(dataset):
+  """Loads all examples in `dataset` into a mapping of numpy arrays."""
+  batches = list(dataset.batch(NUM_EXAMPLES_PER_CLIENT).as_numpy_iterator())
+  return collections.OrderedDict(
+      (name, np.concatenate([batch[name] for batch in batches]))
+      for name in batches[0])
+
+
+def _client_data_to_arrays(client_data):
+  """Loads all examples in `client_data` into `(images, labels)` arrays."""
+  arrays = _dataset_to_arrays(client_data.create_tf_dataset_from_all_clients())
+  return arrays['image'], arrays['label']
+
+
+def _materialize(client_data):
+  """Returns a `tff.simulation.ClientData` holding `client_data` in memory.
+
+  The HDF5-backed CIFAR-100 client data re-reads a client's examples from disk
+  every time its dataset is created. Instead, this reads the examples of every
+  client once (about 150MB for the training clients), and creates client
+  datasets from the resulting numpy arrays. Each client's examples are stored
+  as a contiguous array of images and a contiguous array of labels, and its
+  dataset yields `(image, label)` pairs.
+
+  Args:
+    client_data: A `tff.simulation.ClientData`.
+
+  Returns:
+    A `tff.simulation.ClientData` with the same clients, whose datasets yield
+    the `(image, label)` pairs of the examples of `client_data`.
+  """
+  client_arrays = {}
+  for client_id in client_data.client_ids:
+    arrays = _dataset_to_arrays(
+        client_data.create_tf_dataset_for_client(client_id))
+    client_arrays[client_id] = (arrays['image'], arrays['label'])
+
+  def create_dataset_for_client(client_id):
+    return tf.data.Dataset.from_tensor_slices(client_arrays[client_id])
+
+  return tff.simulation.ClientData.from_clients_and_fn(
+      client_data.client_ids, create_dataset_for_client)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_materialized_data():
+  """Returns the federated CIFAR-100 train and test data, held in memory."""
+  cifar_train, cifar_test = tff.simulation.datasets.cifar100.load_data()
+  return _materialize(cifar_train), _materialize(cifar_test)
+
+
 def get_federated_datasets(
     train_client_batch_size: int = 20,
     test_client_batch_size: int = 100,
@@ -122,7 +399,8 @@ def get_federated_datasets(
     train_shuffle_buffer_size: int = NUM_EXAMPLES_PER_CLIENT,
     test_shuffle_buffer_size: int = 1,
     crop_shape: Tuple[int, int, int] = CIFAR_SHAPE,
-    serializable: bool = False):
+    serializable: bool = False,
+    per_client_parallelism: int = 2):
   """Loads and preprocesses federated CIFAR100 training and testing sets.
 
   Args:
@@ -149,17 +427,18 @@ def get_federated_datasets(
     serializable: Boolean indicating whether the returned datasets are intended
       to be serialized and shipped across RPC channels. If `True`, stateful
       transformations will be disallowed.
+    per_client_parallelism: An integer representing the number of parallel
+      calls used when mapping over each client's dataset. This defaults to a
+      small constant rather than `tf.data.experimental.AUTOTUNE`, since
+      federated simulations preprocess many client datasets in the same
+      process, and autotuning each of them separately oversubscribes the
+      available cores.
 
   Returns:
     A tuple (cifar_train, cifar_test) of `tff.simulation.ClientData` instances
       representing the federated training and test datasets.
   """
-  if not isinstance(crop_shape, collections.abc.Iterable):
-    raise TypeError('Argument crop_shape must be an iterable.')
-  crop_shape = tuple(crop_shape)
-  if len(crop_shape) != 3:
-    raise ValueError('The crop_shape must have length 3, corresponding to a '
-                     'tensor of shape [height, width, channels].')
+  crop_shape = _validate_crop_shape(crop_shape)
   if not isinstance(serializable, bool):
     raise TypeError(
         'serializable must be a Boolean; you passed {} of type {}.'.format(
@@ -169,28 +448,27 @@ def get_federated_datasets(
         'train_client_epochs_per_round must be a positive integer.')
   if test_client_epochs_per_round < 0:
     raise ValueError('test_client_epochs_per_round must be a positive integer.')
-  if train_shuffle_buffer_size <= 1:
-    train_shuffle_buffer_size = 1
-  if test_shuffle_buffer_size <= 1:
-    test_shuffle_buffer_size = 1
 
-  cifar_train, cifar_test = tff.simulation.datasets.cifar100.load_data()
-  train_crop_shape = (train_client_batch_size,) + crop_shape
-  test_crop_shape = (test_client_batch_size,) + crop_shape
+  cifar_train, cifar_test = _load_materialized_data()
 
   train_preprocess_fn = create_preprocess_fn(
       num_epochs=train_client_epochs_per_round,
       batch_size=train_client_batch_size,
       shuffle_buffer_size=train_shuffle_buffer_size,
-      crop_shape=train_crop_shape,
-      distort_image=not serializable)
+      crop_shape=crop_shape,
+      distort_image=not serializable,
+      num_parallel_calls=per_client_parallelism,
+      deterministic=False,
+      serializable=serializable)
 
   test_preprocess_fn = create_preprocess_fn(
       num_epochs=test_client_epochs_per_round,
       batch_size=test_client_batch_size,
       shuffle_buffer_size=test_shuffle_buffer_size,
-      crop_shape=test_crop_shape,
-      distort_image=False)
+      crop_shape=crop_shape,
+      distort_image=False,
+      num_parallel_calls=per_client_parallelism,
+      serializable=serializable)
 
   cifar_train = cifar_train.preprocess(train_preprocess_fn)
   cifar_test = cifar_test.preprocess(test_preprocess_fn)
@@ -202,7 +480,9 @@ def get_centralized_datasets(
     test_batch_size: int = 100,
     train_shuffle_buffer_size: int = 10000,
     test_shuffle_buffer_size: int = 1,
-    crop_shape: Tuple[int, int, int] = CIFAR_SHAPE
+    crop_shape: Tuple[int, int, int] = CIFAR_SHAPE,
+    snapshot_dir: Optional[str] = None,
+    use_numba_pipeline: bool = False
 ) -> Tuple[tf.data.Dataset, tf.data.Dataset]:
   """Loads and preprocesses centralized CIFAR100 training and testing sets.
 
@@ -220,45 +500,73 @@ def get_centralized_datasets(
       (CROP_HEIGHT, CROP_WIDTH, NUM_CHANNELS) which cannot have elements that
       exceed (32, 32, 3), element-wise. The element in the last index should be
       set to 3 to maintain the RGB image structure of the elements.
+    snapshot_dir: An optional directory in which to persist the examples of
+      both datasets before shuffling, so that later calls read them from disk.
+      The training snapshot holds the raw examples, which are distorted after
+      reading it. The test snapshot holds the center-cropped examples, and is
+      kept separately for each `crop_shape`. If `None`, no snapshot is
+      written.
+    use_numba_pipeline: A boolean indicating whether to build the training
+      dataset via `cifar100_numba.create_train_dataset`, which is faster for
+      CPU-only runs and requires `numba` to be installed. This pipeline fully
+      permutes the training examples, so `train_shuffle_buffer_size` is
+      ignored. It cannot be combined with `snapshot_dir`.
 
   Returns:
     A tuple (cifar_train, cifar_test) of `tf.data.Dataset` instances
     representing the centralized training and test datasets.
   """
-  try:
-    crop_shape = tuple(crop_shape)
-  except:
-    raise ValueError(
-        'Argument crop_shape must be able to coerced into a length 3 tuple.')
-  if len(crop_shape) != 3:
-    raise ValueError('The crop_shape must have length 3, corresponding to a '
-                     'tensor of shape [height, width, channels].')
-  if train_shuffle_buffer_size <= 1:
-    train_shuffle_buffer_size = 1
-  if test_shuffle_buffer_size <= 1:
-    test_shuffle_buffer_size = 1
-
-  cifar_train, cifar_test = tff.simulation.datasets.cifar100.load_data()
-  cifar_train = cifar_train.create_tf_dataset_from_all_clients()
+  crop_shape = _validate_crop_shape(crop_shape)
+  if use_numba_pipeline and snapshot_dir is not None:
+    raise ValueError('snapshot_dir cannot be used with the numba pipeline.')
+
+  cifar_train_client_data, cifar_test = (
+      tff.simulation.datasets.cifar100.load_data())
+  cifar_train = cifar_train_client_data.create_tf_dataset_from_all_clients()
+  cifar_train = cifar_train.map(_to_image_label_pair)
   cifar_test = cifar_test.create_tf_dataset_from_all_clients()
-
-  train_crop_shape = (train_batch_size,) + crop_shape
-  test_crop_shape = (test_batch_size,) + crop_shape
-
-  train_preprocess_fn = create_preprocess_fn(
-      num_epochs=1,
-      batch_size=train_batch_size,
-      shuffle_buffer_size=train_shuffle_buffer_size,
-      crop_shape=train_crop_shape,
-      distort_image=True)
-  cifar_train = train_preprocess_fn(cifar_train)
+  cifar_test = cifar_test.map(_to_image_label_pair)
+
+  if snapshot_dir is not None:
+    # The distorted training pipeline has no deterministic example stage, so
+    # its snapshot holds the raw examples and does not depend on `crop_shape`.
+    # The test snapshot holds center-cropped examples, so it is keyed by the
+    # crop shape in order to never read a stale snapshot.
+    train_snapshot_path = os.path.join(snapshot_dir, 'train_raw')
+    test_snapshot_path = os.path.join(
+        snapshot_dir, 'test_crop_{}x{}x{}'.format(*crop_shape))
+  else:
+    train_snapshot_path = None
+    test_snapshot_path = None
+
+  if use_numba_pipeline:
+    # Imported here, so that numba is only required when this path is used.
+    from utils.datasets import cifar100_numba  # pylint: disable=g-import-not-at-top
+    train_images, train_labels = _client_data_to_arrays(
+        cifar_train_client_data)
+    cifar_train = cifar100_numba.create_train_dataset(
+        train_images,
+        train_labels,
+        batch_size=train_batch_size,
+        crop_shape=crop_shape)
+  else:
+    train_preprocess_fn = create_preprocess_fn(
+        num_epochs=1,
+        batch_size=train_batch_size,
+        shuffle_buffer_size=train_shuffle_buffer_size,
+        crop_shape=crop_shape,
+        distort_image=True,
+        deterministic=False,
+        snapshot_path=train_snapshot_path)
+    cifar_train = train_preprocess_fn(cifar_train)
 
   test_preprocess_fn = create_preprocess_fn(
       num_epochs=1,
       batch_size=test_batch_size,
       shuffle_buffer_size=test_shuffle_buffer_size,
-      crop_shape=test_crop_shape,
-      distort_image=False)
+      crop_shape=crop_shape,
+      distort_image=False,
+      snapshot_path=test_snapshot_path)
   cifar_test = test_preprocess_fn(cifar_test)
 
   return cifar_train, cifar_test
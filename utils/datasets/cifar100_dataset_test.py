@@ -13,8 +13,11 @@
 # limitations under the License.
 
 import collections
+from unittest import mock
 
+import numpy as np
 import tensorflow as tf
+import tensorflow_federated as tff
 
 from utils.datasets import cifar100_dataset
 
@@ -23,6 +26,25 @@ def _compute_length_of_dataset(ds):
   return ds.reduce(0, lambda x, _: x + 1)
 
 
+def _create_client_data():
+  client_examples = {
+      'client_0': np.arange(3 * 32 * 32 * 3).reshape((3, 32, 32, 3)) % 256,
+      'client_1': np.arange(2 * 32 * 32 * 3).reshape((2, 32, 32, 3)) % 7,
+  }
+
+  def create_dataset_for_client(client_id):
+    images = client_examples[client_id].astype(np.uint8)
+    num_examples = images.shape[0]
+    return tf.data.Dataset.from_tensor_slices(
+        collections.OrderedDict(
+            coarse_label=np.zeros(num_examples, dtype=np.int64),
+            image=images,
+            label=np.arange(num_examples, dtype=np.int64)))
+
+  return tff.simulation.ClientData.from_clients_and_fn(
+      list(client_examples), create_dataset_for_client)
+
+
 class DatasetTest(tf.test.TestCase):
 
   def test_centralized_cifar_structure(self):
@@ -56,23 +78,209 @@ class DatasetTest(tf.test.TestCase):
     self.assertEqual(test_batch_shape, (5, 28, 28, 3))
 
   def test_no_op_crop_process_cifar_example(self):
-    crop_shape = (1, 1, 1, 3)
-    x = tf.constant([[[[1.0, -1.0, 0.0]]]])  # Has shape (1, 1, 1, 3), mean 0
-    x = x / tf.math.reduce_std(x)  # x now has variance 1
-    simple_example = collections.OrderedDict(image=x, label=0)
+    crop_shape = (32, 32, 3)
+    x = tf.random.uniform(crop_shape, maxval=256, dtype=tf.int32)
+    x = tf.cast(x, tf.uint8)
     image_map = cifar100_dataset.build_image_map(crop_shape, distort=False)
-    cropped_example = image_map(simple_example)
+    cropped_example = image_map(x, 0)
 
     self.assertEqual(cropped_example[0].shape, crop_shape)
-    self.assertAllClose(x, cropped_example[0], rtol=1e-03)
+    self.assertEqual(cropped_example[0].dtype, tf.uint8)
+    self.assertAllEqual(x, cropped_example[0])
     self.assertEqual(cropped_example[1], 0)
 
+  def test_center_crop_process_cifar_example(self):
+    x = tf.cast(tf.reshape(tf.range(32 * 32 * 3), (32, 32, 3)), tf.uint8)
+    image_map = cifar100_dataset.build_image_map((24, 28, 3), distort=False)
+    cropped_example = image_map(x, 0)
+
+    self.assertAllEqual(
+        tf.image.resize_with_crop_or_pad(x, 24, 28), cropped_example[0])
+
+  def test_distort_process_cifar_example(self):
+    x = tf.cast(tf.reshape(tf.range(32 * 32 * 3), (32, 32, 3)), tf.uint8)
+    image_map = cifar100_dataset.build_image_map((24, 24, 3), distort=True)
+    seed = tf.constant([1, 2], dtype=tf.int64)
+    cropped_example = image_map(x, 0, seed)
+
+    self.assertEqual(cropped_example[0].shape, (24, 24, 3))
+    self.assertEqual(cropped_example[0].dtype, tf.uint8)
+    self.assertAllEqual(cropped_example[0], image_map(x, 0, seed)[0])
+
+  def test_normalize_images(self):
+    x = tf.constant([[[1.0, -1.0, 0.0]]])  # Has shape (1, 1, 3)
+    # Undo the per-channel normalization, so that it maps the image back to x.
+    images = x / cifar100_dataset._CIFAR_INV_STD + cifar100_dataset._CIFAR_MEAN
+    normalized_images = cifar100_dataset.normalize_images(images)
+
+    self.assertEqual(normalized_images.dtype, tf.float32)
+    self.assertAllClose(x, normalized_images, rtol=1e-03, atol=1e-05)
+
+  def test_batch_crop_shape(self):
+    images = tf.zeros((4, 32, 32, 3), dtype=tf.uint8)
+    cropped_images = cifar100_dataset._batch_crop(
+        images, (24, 28, 3), seed=(1, 2))
+
+    self.assertEqual(cropped_images.shape, (4, 24, 28, 3))
+    self.assertEqual(cropped_images.dtype, tf.uint8)
+
+  def test_batch_crop_keeps_contiguous_pixels(self):
+    images = tf.reshape(tf.range(2 * 4 * 4, dtype=tf.int32), (2, 4, 4, 1))
+    cropped_images = cifar100_dataset._batch_crop(
+        images, (2, 2, 1), seed=(1, 2))
+
+    for image, cropped_image in zip(images, cropped_images):
+      offset_y, offset_x = divmod(int(cropped_image[0, 0, 0]) % 16, 4)
+      self.assertAllEqual(
+          image[offset_y:offset_y + 2, offset_x:offset_x + 2], cropped_image)
+
+  def test_batch_crop_is_deterministic_given_seed(self):
+    images = tf.reshape(tf.range(8 * 32 * 32 * 3), (8, 32, 32, 3))
+    self.assertAllEqual(
+        cifar100_dataset._batch_crop(images, (24, 24, 3), seed=(3, 4)),
+        cifar100_dataset._batch_crop(images, (24, 24, 3), seed=(3, 4)))
+
+  def test_batch_flip_flips_whole_images(self):
+    images = tf.reshape(tf.range(4 * 2 * 3 * 3, dtype=tf.int32), (4, 2, 3, 3))
+    flipped_images = cifar100_dataset._batch_flip(images, seed=(1, 2))
+
+    self.assertEqual(flipped_images.shape, images.shape)
+    for image, flipped_image in zip(images, flipped_images):
+      if not tf.reduce_all(tf.equal(image, flipped_image)):
+        self.assertAllEqual(tf.reverse(image, axis=[1]), flipped_image)
+
+  def test_materialize_round_trips_client_examples(self):
+    client_data = _create_client_data()
+    materialized_data = cifar100_dataset._materialize(client_data)
+
+    self.assertEqual(materialized_data.client_ids, client_data.client_ids)
+    for client_id in client_data.client_ids:
+      expected = list(
+          client_data.create_tf_dataset_for_client(client_id)
+          .as_numpy_iterator())
+      actual = list(
+          materialized_data.create_tf_dataset_for_client(client_id)
+          .as_numpy_iterator())
+      self.assertLen(actual, len(expected))
+      for expected_example, (image, label) in zip(expected, actual):
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertAllEqual(expected_example['image'], image)
+        self.assertAllEqual(expected_example['label'], label)
+
+  def test_load_materialized_data_is_cached(self):
+    cifar100_dataset._load_materialized_data.cache_clear()
+    self.addCleanup(cifar100_dataset._load_materialized_data.cache_clear)
+    with mock.patch.object(
+        tff.simulation.datasets.cifar100,
+        'load_data',
+        return_value=(_create_client_data(),
+                      _create_client_data())) as mock_load_data:
+      first_data = cifar100_dataset._load_materialized_data()
+      second_data = cifar100_dataset._load_materialized_data()
+
+    mock_load_data.assert_called_once_with()
+    self.assertIs(first_data, second_data)
+
   def test_raises_length_2_crop(self):
     with self.assertRaises(ValueError):
       cifar100_dataset.get_federated_datasets(crop_shape=(32, 32))
     with self.assertRaises(ValueError):
       cifar100_dataset.get_centralized_datasets(crop_shape=(32, 32))
 
+  def test_raises_oversized_crop(self):
+    with self.assertRaises(ValueError):
+      cifar100_dataset.create_preprocess_fn(
+          num_epochs=1,
+          batch_size=20,
+          shuffle_buffer_size=1,
+          crop_shape=(36, 36, 3))
+
+  def test_raises_crop_with_fewer_channels(self):
+    with self.assertRaisesRegex(ValueError, 'channels'):
+      cifar100_dataset.create_preprocess_fn(
+          num_epochs=1,
+          batch_size=20,
+          shuffle_buffer_size=1,
+          crop_shape=(24, 24, 1))
+
+  def test_preprocess_fn_is_reused_for_same_arguments(self):
+    preprocess_fn = cifar100_dataset.create_preprocess_fn(
+        num_epochs=1,
+        batch_size=20,
+        shuffle_buffer_size=1,
+        crop_shape=[24, 24, 3])
+    self.assertIs(
+        preprocess_fn,
+        cifar100_dataset.create_preprocess_fn(
+            num_epochs=1,
+            batch_size=20,
+            shuffle_buffer_size=0,
+            crop_shape=(24, 24, 3)))
+
+  def test_snapshot_round_trip(self):
+    images = tf.cast(
+        tf.reshape(tf.range(8 * 32 * 32 * 3) % 256, (8, 32, 32, 3)), tf.uint8)
+    labels = tf.range(8, dtype=tf.int64)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    snapshot_path = self.get_temp_dir()
+    preprocess_fn = cifar100_dataset.create_preprocess_fn(
+        num_epochs=1,
+        batch_size=4,
+        shuffle_buffer_size=1,
+        crop_shape=(24, 24, 3),
+        snapshot_path=snapshot_path)
+
+    first_batches = list(preprocess_fn(dataset))
+    self.assertNotEmpty(tf.io.gfile.listdir(snapshot_path))
+    second_batches = list(preprocess_fn(dataset))
+
+    self.assertLen(second_batches, len(first_batches))
+    for first_batch, second_batch in zip(first_batches, second_batches):
+      self.assertAllEqual(first_batch[0], second_batch[0])
+      self.assertAllEqual(first_batch[1], second_batch[1])
+    self.assertAllEqual(
+        tf.image.resize_with_crop_or_pad(images[:4], 24, 24),
+        first_batches[0][0])
+
+  def test_distorted_preprocess_fn_crops_and_flips(self):
+    # Each pixel stores its row, its column and the index of its image, so
+    # that the crop and flip of every output image can be recovered.
+    rows, columns = np.meshgrid(np.arange(32), np.arange(32), indexing='ij')
+    images = np.stack([
+        np.stack([rows, columns, np.full((32, 32), index)], axis=-1)
+        for index in range(6)
+    ]).astype(np.uint8)
+    labels = np.arange(6, dtype=np.int64)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels))
+    preprocess_fn = cifar100_dataset.create_preprocess_fn(
+        num_epochs=1,
+        batch_size=4,
+        shuffle_buffer_size=1,
+        crop_shape=(24, 28, 3),
+        distort_image=True)
+
+    batches = list(preprocess_fn(dataset).as_numpy_iterator())
+    self.assertEqual([len(batch_labels) for _, batch_labels in batches], [4, 2])
+    self.assertAllEqual(
+        np.concatenate([batch_labels for _, batch_labels in batches]), labels)
+    for batch_images, batch_labels in batches:
+      self.assertEqual(batch_images.dtype, np.uint8)
+      self.assertEqual(batch_images.shape[1:], (24, 28, 3))
+      for image, label in zip(batch_images, batch_labels):
+        self.assertAllEqual(image[:, :, 2], np.full((24, 28), label))
+        self.assertAllEqual(image[:, :, 0],
+                            rows[:24, :28] + image[0, 0, 0])
+        offset_x = min(image[0, 0, 1], image[0, -1, 1])
+        expected_columns = columns[:24, :28] + offset_x
+        if image[0, 0, 1] > image[0, -1, 1]:
+          expected_columns = expected_columns[:, ::-1]
+        self.assertAllEqual(image[:, :, 1], expected_columns)
+
+  def test_raises_snapshot_with_numba_pipeline(self):
+    with self.assertRaisesRegex(ValueError, 'numba'):
+      cifar100_dataset.get_centralized_datasets(
+          snapshot_dir=self.get_temp_dir(), use_numba_pipeline=True)
+
   def test_raises_negative_epochs(self):
     with self.assertRaisesRegex(
         ValueError, 'client_epochs_per_round must be a positive integer.'):
@@ -0,0 +1,57 @@
+# Copyright 2020, Google LLC.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import tensorflow as tf
+
+from utils.datasets import cifar100_numba
+
+
+class Cifar100NumbaTest(tf.test.TestCase):
+
+  def test_preprocess_batch_matches_numpy(self):
+    images = np.arange(5 * 8 * 8 * 3, dtype=np.int64).astype(np.uint8)
+    images = images.reshape((5, 8, 8, 3))
+    indices = np.array([3, 0, 4])
+    crop_y = np.array([0, 2, 4])
+    crop_x = np.array([4, 0, 1])
+    flip_mask = np.array([False, True, True])
+    out = np.empty((3, 4, 4, 3), dtype=np.uint8)
+    cifar100_numba.preprocess_batch(images, indices, out, crop_y, crop_x,
+                                    flip_mask)
+
+    for i, index in enumerate(indices):
+      expected = images[index, crop_y[i]:crop_y[i] + 4,
+                        crop_x[i]:crop_x[i] + 4]
+      if flip_mask[i]:
+        expected = expected[:, ::-1]
+      self.assertAllEqual(expected, out[i])
+
+  def test_train_dataset_structure(self):
+    images = np.zeros((10, 32, 32, 3), dtype=np.uint8)
+    labels = np.arange(10)
+    dataset = cifar100_numba.create_train_dataset(
+        images, labels, batch_size=4, crop_shape=(24, 24, 3), seed=0)
+
+    batches = list(dataset)
+    self.assertLen(batches, 3)
+    self.assertEqual(tuple(batches[0][0].shape), (4, 24, 24, 3))
+    self.assertEqual(batches[0][0].dtype, tf.uint8)
+    self.assertEqual(tuple(batches[-1][0].shape), (2, 24, 24, 3))
+    self.assertCountEqual(
+        np.concatenate([batch_labels for _, batch_labels in batches]), labels)
+
+
+if __name__ == '__main__':
+  tf.test.main()